@@ -1,23 +1,116 @@
+import asyncio
+import hashlib
+import io
 import json
 import logging
-import requests
+import random
+import time
+import httpx
+import orjson
 import re
+from collections import OrderedDict
 
 logger = logging.getLogger(__name__)
 
+PARSE_ERROR_MESSAGE = "Failed to parse the automated review results."
+
+# Extracts a JSON object from a markdown code fence
+_JSON_BLOCK_RE = re.compile(r"```(?:json)?\s*(\{.*?\})\s*```", re.DOTALL)
+
+# Static system prompt. It must stay byte-identical across calls so providers can serve it from their prompt cache.
+SYSTEM_PROMPT = """
+I am an automated code review bot analyzing Gerrit diffs. My task is to meticulously analyze the provided code diff and offer insightful, actionable feedback. Focus on:
+1.  **Potential Bugs:** Identify logical errors, edge cases, race conditions, security vulnerabilities (e.g., XSS, SQLi), etc.
+2.  **Best Practices & Design Patterns:** Suggest improvements based on established software engineering principles (SOLID, DRY, KISS) and relevant design patterns.
+3.  **Readability & Maintainability:** Comment on code clarity, naming conventions (e.g., camelCase for variables/functions, PascalCase for classes), complexity (e.g., Cyclomatic complexity), and opportunities for simplification or refactoring. Mention magic numbers or hardcoded strings if they appear.
+4.  **Performance:** Highlight any potential performance bottlenecks (e.g., inefficient loops, unnecessary computations) or suggest optimizations.
+5.  **Testability:** Comment on how easy or difficult the code would be to test (e.g., presence of side effects, tight coupling) and suggest improvements for better testability.
+6.  **Style Guide Adherence (General):** Point out common style issues (e.g., inconsistent indentation, mixed quotes). Assume a generally accepted style guide like Google's JavaScript Style Guide or Python's PEP 8 if the language is identifiable.
+7.  **Security Considerations:** If applicable, point out any security flaws or areas that need hardening.
+8.  **Clarity of Comments and Documentation:** Assess if comments are helpful, or if code needs more comments or better docstrings.
+"""
+
+# Output format instructions appended after the diffs in every user prompt
+_PROMPT_FOOTER = """
+Please provide your review in the following EXACT JSON format:
+{
+  "summary": "Overall summary of the changes and your assessment.",
+  "vote": <int>,
+  "comments": {
+    "filename/with/path.py": [
+      {
+        "line": <int>,
+        "message": "Inline comment for this specific modified or added line."
+      }
+    ]
+  }
+}
+
+Rules:
+- The `vote` field must be an integer: +1 (looks good), 0 (neutral), or -1 (issues found). Do not vote +2 or -2.
+- The `comments` dictionary should have filenames exactly as provided above as keys.
+- Inside the array for each filename, the `line` must be the line number in the unified diff context that you are commenting on. If you cannot determine the line number, omit the inline comment and put the feedback in the summary.
+- You CANNOT post inline comments on removed lines (lines starting with '-'). Only post inline comments for added or unchanged lines (lines with a line number).
+- Omit markdown syntax, backticks, or other formatting around the JSON string. Output ONLY valid JSON.
+- If the diff is empty, trivial, or contains no significant code changes (e.g., only comments or whitespace changes), state that clearly.
+- Be specific in your suggestions. Instead of saying "this could be better", explain *how* it could be better and suggest a specific change.
+- If you identify a critical issue, please flag it as such. Only vote -1 if there are critical issues.
+- Only comment on areas that really need improvement. Do not comment on things that are just minor or cosmetic. If there is no notable area to comment on, just give a summary for the code review and +1 vote.
+- Zero Fluff: No philosophical lectures or unsolicited advice.
+- Stay Focused: Concise answers only. No wandering.
+"""
+
+# Proxy responses worth retrying: rate limits and transient upstream failures
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+MAX_RETRY_DELAY = 30
+
 class LiteLLMAnalyzer:
     """Analyzes Gerrit diffs using an LLM via LiteLLM."""
 
-    def __init__(self, api_base, model, api_key=None, temperature=0.2):
+    def __init__(self, api_base, model, api_key=None, temperature=0.2, max_workers=5, cache_size=1024, cache_ttl=3600,
+                 max_tokens=1024, max_retries=2, stream=False, max_diff_chars=20000, max_prompt_chars=200000,
+                 cache_system_prompt=False):
         self.api_base = api_base
         self.model = model
         self.api_key = api_key
         self.temperature = temperature
+        self.max_workers = max_workers
+        self.max_tokens = max_tokens
+        self.max_retries = max_retries
+        self.stream = stream
+        self.cache_system_prompt = cache_system_prompt
+        # Input size caps: prompt length drives both latency (time to first token) and cost
+        self.max_diff_chars = max_diff_chars
+        self.max_prompt_chars = max_prompt_chars
+        # Keep idle proxy connections alive between reviews so later calls reuse the warm TLS session
+        # instead of paying a fresh TCP + TLS handshake. Connection failures are retried by the transport.
+        transport = httpx.AsyncHTTPTransport(
+            retries=3,
+            limits=httpx.Limits(
+                max_connections=max_workers,
+                max_keepalive_connections=max_workers,
+                keepalive_expiry=300,
+            ),
+        )
+        # Fail fast on connect; the read timeout only needs to cover a bounded (max_tokens) response
+        self._client = httpx.AsyncClient(timeout=httpx.Timeout(90, connect=10), transport=transport)
+        # Created lazily so it binds to the event loop that runs the reviews
+        self._semaphore = None
+        # LRU of prompt hash -> (stored_at, parsed result). Only touched from the review loop, so no lock.
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        self._cache = OrderedDict()
 
-    def analyze(self, diffs):
+    async def analyze(self, diffs, valid_lines=None):
         """
         Takes a dict of filename -> diff string, and returns a review message 
         and optional inline comments.
+
+        If valid_lines (filename -> set of commentable line numbers) is given,
+        inline comments on any other line are dropped before posting.
+
+        Each file is reviewed by its own LLM call and the calls run concurrently,
+        so wall-clock time tracks the slowest file rather than the whole changelist.
         
         Returns:
             tuple: (message: str, comments: dict, vote: int)
@@ -25,28 +118,154 @@ class LiteLLMAnalyzer:
         if not diffs:
             return "No valid diffs found to review.", None, 0
 
+        diffs, notes = self._prepare_diffs(diffs)
+        if not diffs:
+            return "\n".join(["No valid diffs found to review."] + notes), None, 0
+
+        logger.info(f"Sending {len(diffs)} file prompt(s) to LLM: {self.model} at {self.api_base}")
+
+        filenames = list(diffs.keys())
+        tasks = [asyncio.create_task(self._analyze_one(f, d, valid_lines)) for f, d in diffs.items()]
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+
+        return self._merge_results(filenames, results, notes)
+
+    def _prepare_diffs(self, diffs):
+        """
+        Drops diffs without content or with whitespace-only changes, truncates oversized ones and enforces the overall
+        prompt budget by dropping the largest remaining diffs first.
+
+        Returns:
+            tuple: (diffs: dict, notes: list of str describing what was left out)
+        """
+        prepared = {}
+        # One note per file; dropping a truncated file replaces its truncation note
+        notes = {}
+
+        for filename, diff in diffs.items():
+            if not self._has_line_changes(diff):
+                logger.debug(f"Skipping diff without content changes: {filename}")
+                notes[filename] = f"* Skipped `{filename}`: no content changes (rename or mode change only)."
+                continue
+
+            if self._is_whitespace_only(diff):
+                logger.debug(f"Skipping whitespace-only diff: {filename}")
+                notes[filename] = f"* Skipped `{filename}`: whitespace-only changes."
+                continue
+
+            if len(diff) > self.max_diff_chars:
+                diff, elided = self._truncate_diff(diff, self.max_diff_chars)
+                logger.info(f"Truncated diff for {filename} ({elided} lines elided)")
+                notes[filename] = f"* Truncated `{filename}`: {elided} lines of a large diff were not reviewed."
+
+            prepared[filename] = diff
+
+        total = sum(len(d) for d in prepared.values())
+        for filename in sorted(prepared, key=lambda f: len(prepared[f]), reverse=True):
+            if total <= self.max_prompt_chars:
+                break
+            total -= len(prepared.pop(filename))
+            logger.info(f"Dropping {filename} from the review to stay within the prompt budget")
+            notes[filename] = f"* Skipped `{filename}`: the change is too large to review in full."
+
+        return prepared, list(notes.values())
+
+    def _has_line_changes(self, diff):
+        """False for diffs that only carry headers, e.g. a pure rename or mode change."""
+        for line in diff.split("\n"):
+            # Formatted diff lines look like " 1234 | +content" or "      | -content"
+            _, sep, rest = line.partition(" | ")
+            if sep and rest[:1] in ("+", "-"):
+                return True
+        return False
+
+    def _is_whitespace_only(self, diff):
+        """True if every change replaces lines with the same lines, up to spacing.
+
+        Each run of removed lines is paired with the run of added lines directly after it in
+        the same hunk; both must have the same length and match line by line. A line that is
+        moved (removed in one place, added in another) therefore always counts as a change.
+        """
+        removed = []
+        added = []
+        changed = False
+        for line in diff.split("\n"):
+            _, sep, rest = line.partition(" | ")
+            marker = rest[:1] if sep else ""
+
+            # Context lines, hunk headers and a "-" after "+" all end the current pair of runs
+            if (marker not in ("+", "-") or (marker == "-" and added)) and (removed or added):
+                if not self._same_up_to_spacing(removed, added):
+                    return False
+                removed = []
+                added = []
+
+            if marker == "-":
+                removed.append(rest[1:])
+                changed = True
+            elif marker == "+":
+                added.append(rest[1:])
+                changed = True
+
+        return changed and self._same_up_to_spacing(removed, added)
+
+    def _same_up_to_spacing(self, removed, added):
+        return len(removed) == len(added) and all(
+            self._normalize_spacing(old) == self._normalize_spacing(new) for old, new in zip(removed, added)
+        )
+
+    @staticmethod
+    def _normalize_spacing(content):
+        """Drops trailing whitespace; outside of lines with string literals, also collapses inner spacing.
+
+        Leading indentation is always kept, since it can change control flow.
+        """
+        if any(quote in content for quote in ("'", '"', "`")):
+            # Spacing inside a literal is data
+            return content.rstrip()
+        stripped = content.lstrip()
+        return content[:len(content) - len(stripped)] + " ".join(stripped.split())
+
+    def _truncate_diff(self, diff, max_chars):
+        """Keeps the head and tail of a diff within max_chars and elides the middle."""
+        lines = diff.split("\n")
+        budget = max_chars // 2
+
+        head = []
+        size = 0
+        for line in lines:
+            size += len(line) + 1
+            if size > budget:
+                break
+            head.append(line)
+
+        tail = []
+        size = 0
+        for line in reversed(lines[len(head):]):
+            size += len(line) + 1
+            if size > budget:
+                break
+            tail.append(line)
+        tail.reverse()
+
+        elided = len(lines) - len(head) - len(tail)
+        return "\n".join(head + [f"... [diff truncated {elided} lines] ..."] + tail), elided
+
+    async def _analyze_one(self, filename, diff, valid_lines=None):
+        """
+        Reviews a single file's diff.
+
+        Returns:
+            tuple: (message: str, comments: dict, vote: int, usage: dict or None)
+        """
         # Construct a prompt for the LLM
-        prompt = self._build_prompt(diffs)
-        
-        logger.info(f"Sending prompt to LLM: {self.model} at {self.api_base}")
+        prompt = self._build_prompt({filename: diff})
 
         try:
             # Let litellm handle provider routing
             target_model = self.model
 
-            system_prompt = """
-I am an automated code review bot analyzing Gerrit diffs. My task is to meticulously analyze the provided code diff and offer insightful, actionable feedback. Focus on:
-1.  **Potential Bugs:** Identify logical errors, edge cases, race conditions, security vulnerabilities (e.g., XSS, SQLi), etc.
-2.  **Best Practices & Design Patterns:** Suggest improvements based on established software engineering principles (SOLID, DRY, KISS) and relevant design patterns.
-3.  **Readability & Maintainability:** Comment on code clarity, naming conventions (e.g., camelCase for variables/functions, PascalCase for classes), complexity (e.g., Cyclomatic complexity), and opportunities for simplification or refactoring. Mention magic numbers or hardcoded strings if they appear.
-4.  **Performance:** Highlight any potential performance bottlenecks (e.g., inefficient loops, unnecessary computations) or suggest optimizations.
-5.  **Testability:** Comment on how easy or difficult the code would be to test (e.g., presence of side effects, tight coupling) and suggest improvements for better testability.
-6.  **Style Guide Adherence (General):** Point out common style issues (e.g., inconsistent indentation, mixed quotes). Assume a generally accepted style guide like Google's JavaScript Style Guide or Python's PEP 8 if the language is identifiable.
-7.  **Security Considerations:** If applicable, point out any security flaws or areas that need hardening.
-8.  **Clarity of Comments and Documentation:** Assess if comments are helpful, or if code needs more comments or better docstrings.
-"""
-            
-            # Call via requests to get exact proxy headers (for x-litellm-response-cost)
+            # Call the proxy directly to get exact proxy headers (for x-litellm-response-cost)
             endpoint = f"{self.api_base.rstrip('/')}/chat/completions"
             headers = {
                 "Content-Type": "application/json",
@@ -55,121 +274,282 @@ I am an automated code review bot analyzing Gerrit diffs. My task is to meticulo
             payload = {
                 "model": target_model,
                 "messages": [
-                    {"role": "system", "content": system_prompt},
+                    self._system_message(),
                     {"role": "user", "content": prompt}
                 ],
                 "response_format": {"type": "json_object"},
-                "temperature": self.temperature
+                "temperature": self.temperature,
+                # The review JSON is small; cap output so a runaway model can't inflate latency and cost
+                "max_tokens": self.max_tokens,
+                "stream": self.stream
             }
+            if self.stream:
+                # Ask for a final usage chunk so token stats survive streaming
+                payload["stream_options"] = {"include_usage": True}
+
+            # Identical prompts (bot re-added, retries, rebases with the same diff) reuse the earlier review
+            cache_key = self._cache_key(target_model, SYSTEM_PROMPT, prompt)
+            cached = self._cache_get(cache_key)
+            if cached is not None:
+                logger.info(f"Using cached LLM review for {filename}")
+                message, gerrit_comments, vote = cached
+                return message, gerrit_comments, vote, None
+
+            resp, response_json = await self._post_with_retries(endpoint, headers, payload)
 
-            resp = requests.post(endpoint, headers=headers, json=payload, timeout=300)
-            
             if resp.status_code == 401:
-                return f"Authentication Error: Please check your LLM provider API keys.", {}, 0
+                return f"Authentication Error: Please check your LLM provider API keys.", {}, 0, None
             elif resp.status_code == 429:
-                return f"Rate Limit Exceeded: The LLM provider rejected the request due to quota limits.", {}, 0
+                return f"Rate Limit Exceeded: The LLM provider rejected the request due to quota limits.", {}, 0, None
             
             resp.raise_for_status()
-            response_json = resp.json()
+            if response_json is None:
+                response_json = resp.json()
 
             result_content = response_json.get("choices", [{}])[0].get("message", {}).get("content", "")
-            logger.debug(f"LLM Raw Response: {result_content}")
+            logger.debug(f"LLM Raw Response for {filename}: {result_content}")
 
-            message, gerrit_comments, vote = self._parse_llm_response(result_content)
-            
-            # Append token usage and estimated cost to the summary message
-            try:
-                # Safely extract usage stats from the JSON payload
-                usage = response_json.get("usage", {})
-                prompt_tokens = usage.get("prompt_tokens", 0)
-                completion_tokens = usage.get("completion_tokens", 0)
-                total_tokens = usage.get("total_tokens", 0)
-                
-                # Extract cost tracked directly by the proxy
-                cost_header = resp.headers.get("x-litellm-response-cost")
-                cost = float(cost_header) if cost_header else 0.0
-                
-                # Grab the final model string the proxy executed.
-                # LiteLLM proxy returns x-litellm-model-api-base if it's forwarding to a provider
-                api_base_header = resp.headers.get("x-litellm-model-api-base", "")
-                
-                # Try to extract a clean model name or fallback to the JSON model alias
-                if api_base_header and 'models/' in api_base_header:
-                    # For providers like gemini
-                    final_model = api_base_header.split('models/')[-1].split(':')[0]
-                elif api_base_header and 'openai' not in api_base_header.lower():
-                    # For generically patterned URL endpoints
-                    final_model = f"{response_json.get('model', self.model)} (via {api_base_header.split('/')[2]})"
-                else:
-                    final_model = response_json.get("model", self.model)
-                
-                stats_msg = (
-                    f"\n\n---\n**LLM Usage Stats:**\n"
-                    f"* Model: {final_model}\n"
-                    f"* Input Tokens: {prompt_tokens}\n"
-                    f"* Output Tokens: {completion_tokens}\n"
-                    f"* Total Tokens: {total_tokens}\n"
-                    f"* Estimated Cost: ${cost:.6f}"
-                )
-                message += stats_msg
-            except Exception as e:
-                logger.warning(f"Could not extract token usage or cost: {e}")
+            message, gerrit_comments, vote = self._parse_llm_response(result_content, valid_lines)
+            usage = self._extract_usage(resp, response_json)
+            if message != PARSE_ERROR_MESSAGE:
+                self._cache_put(cache_key, (message, gerrit_comments, vote))
 
-            return message, gerrit_comments, vote
+            return message, gerrit_comments, vote, usage
 
-        except requests.exceptions.RequestException as e:
+        except httpx.HTTPError as e:
             logger.error(f"HTTP Request Error calling LiteLLM Proxy: {e}")
-            return f"LLM API Error: Could not reach the LiteLLM Proxy. Details: {e}", {}, 0
+            return f"LLM API Error: Could not reach the LiteLLM Proxy. Details: {e}", {}, 0, None
         except Exception as e:
             logger.error(f"Unexpected error calling LiteLLM Proxy: {e}")
-            return f"An error occurred during automated code review: {e}", {}, 0
+            return f"An error occurred during automated code review: {e}", {}, 0, None
 
-    def _build_prompt(self, diffs):
-        prompt = "Review the following code changes:\n\n"
-        for idx, (filename, diff) in enumerate(diffs.items()):
-            prompt += f"--- File: {filename} ---\n```\n{diff}\n```\n\n"
-        
-        prompt += """
-Please provide your review in the following EXACT JSON format:
-{
-  "summary": "Overall summary of the changes and your assessment.",
-  "vote": <int>,
-  "comments": {
-    "filename/with/path.py": [
-      {
-        "line": <int>,
-        "message": "Inline comment for this specific modified or added line."
-      }
-    ]
-  }
-}
+    def _system_message(self):
+        """
+        Builds the system message. With cache_system_prompt it carries an Anthropic-style
+        cache_control marker (passed through by LiteLLM) so the provider caches the prefix;
+        providers with automatic prefix caching (e.g. OpenAI) only need the bytes to be stable.
+        """
+        if self.cache_system_prompt:
+            return {
+                "role": "system",
+                "content": [{"type": "text", "text": SYSTEM_PROMPT, "cache_control": {"type": "ephemeral"}}],
+            }
+        return {"role": "system", "content": SYSTEM_PROMPT}
 
-Rules:
-- The `vote` field must be an integer: +1 (looks good), 0 (neutral), or -1 (issues found). Do not vote +2 or -2.
-- The `comments` dictionary should have filenames exactly as provided above as keys.
-- Inside the array for each filename, the `line` must be the line number in the unified diff context that you are commenting on. If you cannot determine the line number, omit the inline comment and put the feedback in the summary.
-- You CANNOT post inline comments on removed lines (lines starting with '-'). Only post inline comments for added or unchanged lines (lines with a line number).
-- Omit markdown syntax, backticks, or other formatting around the JSON string. Output ONLY valid JSON.
-- If the diff is empty, trivial, or contains no significant code changes (e.g., only comments or whitespace changes), state that clearly.
-- Be specific in your suggestions. Instead of saying "this could be better", explain *how* it could be better and suggest a specific change.
-- If you identify a critical issue, please flag it as such. Only vote -1 if there are critical issues.
-- Only comment on areas that really need improvement. Do not comment on things that are just minor or cosmetic. If there is no notable area to comment on, just give a summary for the code review and +1 vote.
-- Zero Fluff: No philosophical lectures or unsolicited advice.
-- Stay Focused: Concise answers only. No wandering.
-"""
-        return prompt
+    async def _post_with_retries(self, endpoint, headers, payload):
+        """
+        POSTs to the proxy, retrying rate-limited and transient 5xx responses with jittered backoff.
+
+        Returns:
+            tuple: (response, response_json) where response_json is the completion reassembled
+            from the event stream for successful streamed calls, and None otherwise (the body
+            has then been read and is available through response.json()).
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_workers)
+
+        for attempt in range(self.max_retries + 1):
+            retry = False
+            response_json = None
+            request = self._client.build_request("POST", endpoint, headers=headers, json=payload)
+
+            # Bound concurrent LLM calls so bursts of reviews stay under provider rate limits
+            async with self._semaphore:
+                resp = await self._client.send(request, stream=True)
+                try:
+                    if resp.status_code in RETRYABLE_STATUS_CODES and attempt < self.max_retries:
+                        retry = True
+                    elif payload.get("stream") and resp.is_success:
+                        response_json = await self._read_event_stream(resp)
+                    else:
+                        await resp.aread()
+                finally:
+                    await resp.aclose()
+
+            if not retry:
+                return resp, response_json
+
+            delay = self._retry_delay(resp, attempt)
+            logger.warning(f"LiteLLM Proxy returned {resp.status_code}. Retrying in {delay:.1f}s "
+                           f"(attempt {attempt + 1}/{self.max_retries})")
+            await asyncio.sleep(delay)
+
+    async def _read_event_stream(self, resp):
+        """
+        Consumes an OpenAI-style server-sent event stream and reassembles it into the
+        shape of a non-streamed completion, so the rest of the pipeline is unchanged.
+        The per-read timeout then applies between chunks rather than to the whole answer.
+        """
+        content_parts = []
+        usage = {}
+        model = None
+
+        async for line in resp.aiter_lines():
+            if not line.startswith("data:"):
+                continue
+
+            data = line[len("data:"):].strip()
+            if data == "[DONE]":
+                break
 
-    def _parse_llm_response(self, raw_content):
-        # Use regex to robustly extract JSON block if models output markdown tags despite instructions
-        json_match = re.search(r"```(?:json)?\s*(\{.*?\})\s*```", raw_content, re.DOTALL)
-        if json_match:
-            clean_content = json_match.group(1).strip()
+            chunk = json.loads(data)
+            model = chunk.get("model") or model
+            if chunk.get("usage"):
+                usage = chunk["usage"]
+            for choice in chunk.get("choices") or []:
+                delta = choice.get("delta") or {}
+                if delta.get("content"):
+                    content_parts.append(delta["content"])
+
+        response_json = {
+            "choices": [{"message": {"content": "".join(content_parts)}}],
+            "usage": usage,
+        }
+        if model:
+            response_json["model"] = model
+        return response_json
+
+    def _retry_delay(self, resp, attempt):
+        """Honours a numeric Retry-After header, otherwise backs off exponentially with jitter."""
+        retry_after = resp.headers.get("retry-after")
+        if retry_after:
+            try:
+                return min(max(float(retry_after), 0.0), MAX_RETRY_DELAY)
+            except ValueError:
+                pass
+        return min(2 ** attempt + random.random(), MAX_RETRY_DELAY)
+
+    def _cache_key(self, model, system_prompt, prompt):
+        """Hashes everything that determines the LLM output into a cache key."""
+        key_data = json.dumps({"m": model, "t": self.temperature, "s": system_prompt, "u": prompt}, sort_keys=True)
+        return hashlib.sha256(key_data.encode("utf-8")).hexdigest()
+
+    def _cache_get(self, key):
+        entry = self._cache.get(key)
+        if entry is None:
+            return None
+
+        stored_at, result = entry
+        if time.monotonic() - stored_at > self.cache_ttl:
+            del self._cache[key]
+            return None
+
+        self._cache.move_to_end(key)
+        return result
+
+    def _cache_put(self, key, result):
+        if self.cache_size <= 0:
+            return
+
+        self._cache[key] = (time.monotonic(), result)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def _extract_usage(self, resp, response_json):
+        """Returns token usage, proxy-reported cost and the executed model, or None if unavailable."""
+        try:
+            # Safely extract usage stats from the JSON payload
+            usage = response_json.get("usage", {})
+
+            # Extract cost tracked directly by the proxy
+            cost_header = resp.headers.get("x-litellm-response-cost")
+            cost = float(cost_header) if cost_header else 0.0
+            
+            # Grab the final model string the proxy executed.
+            # LiteLLM proxy returns x-litellm-model-api-base if it's forwarding to a provider
+            api_base_header = resp.headers.get("x-litellm-model-api-base", "")
+            
+            # Try to extract a clean model name or fallback to the JSON model alias
+            if api_base_header and 'models/' in api_base_header:
+                # For providers like gemini
+                final_model = api_base_header.split('models/')[-1].split(':')[0]
+            elif api_base_header and 'openai' not in api_base_header.lower():
+                # For generically patterned URL endpoints
+                final_model = f"{response_json.get('model', self.model)} (via {api_base_header.split('/')[2]})"
+            else:
+                final_model = response_json.get("model", self.model)
+
+            return {
+                "model": final_model,
+                "prompt_tokens": usage.get("prompt_tokens", 0),
+                "completion_tokens": usage.get("completion_tokens", 0),
+                "total_tokens": usage.get("total_tokens", 0),
+                "cost": cost,
+            }
+        except Exception as e:
+            logger.warning(f"Could not extract token usage or cost: {e}")
+            return None
+
+    def _merge_results(self, filenames, results, notes=None):
+        """
+        Reduces per-file results into a single review: the lowest vote wins,
+        summaries are concatenated per file and inline comments are merged.
+        """
+        summaries = []
+        merged_comments = {}
+        votes = []
+        usages = []
+
+        for filename, result in zip(filenames, results):
+            if isinstance(result, BaseException):
+                logger.error(f"Review of {filename} failed: {result}")
+                result = (f"An error occurred during automated code review: {result}", {}, 0, None)
+
+            message, comments, vote, usage = result
+            summaries.append((filename, message))
+            votes.append(vote)
+            if usage:
+                usages.append(usage)
+
+            for path, file_comments in (comments or {}).items():
+                merged_comments.setdefault(path, []).extend(file_comments)
+
+        if len(summaries) == 1:
+            message = summaries[0][1]
         else:
-            # Fallback to just stripping the string if no markdown block is found
-            clean_content = raw_content.strip()
+            message = "\n\n".join(f"**{filename}:** {summary}" for filename, summary in summaries)
+
+        if notes:
+            message += "\n\n**Not reviewed in full:**\n" + "\n".join(notes)
+
+        # Append token usage and estimated cost to the summary message
+        if usages:
+            message += (
+                f"\n\n---\n**LLM Usage Stats:**\n"
+                f"* Model: {usages[0]['model']}\n"
+                f"* Input Tokens: {sum(u['prompt_tokens'] for u in usages)}\n"
+                f"* Output Tokens: {sum(u['completion_tokens'] for u in usages)}\n"
+                f"* Total Tokens: {sum(u['total_tokens'] for u in usages)}\n"
+                f"* Estimated Cost: ${sum(u['cost'] for u in usages):.6f}"
+            )
+
+        return message, merged_comments, min(votes)
 
+    def _build_prompt(self, diffs):
+        # Write into one buffer; repeated += on a large prompt string copies it on every append
+        buf = io.StringIO()
+        buf.write("Review the following code changes:\n\n")
+        for filename, diff in diffs.items():
+            buf.write("--- File: ")
+            buf.write(filename)
+            buf.write(" ---\n```\n")
+            buf.write(diff)
+            buf.write("\n```\n\n")
+        buf.write(_PROMPT_FOOTER)
+        return buf.getvalue()
+
+    def _parse_llm_response(self, raw_content, valid_lines=None):
         try:
-            parsed = json.loads(clean_content)
+            try:
+                # JSON mode is requested, so conformant providers return bare JSON
+                parsed = orjson.loads(raw_content)
+            except orjson.JSONDecodeError:
+                # Use regex to robustly extract JSON block if models output markdown tags despite instructions
+                json_match = _JSON_BLOCK_RE.search(raw_content)
+                if not json_match:
+                    raise
+                parsed = orjson.loads(json_match.group(1).strip())
             
             message = parsed.get("summary", "Automated code review completed.")
             vote = parsed.get("vote", 0)
@@ -184,9 +564,25 @@ Rules:
             # Format: {"tests/test_something.py": [{"line": 10, "message": "Typo here"}]}
             gerrit_comments = parsed.get("comments", {})
 
+            # Gerrit rejects inline comments on lines that don't exist on the new side (e.g. removed lines)
+            if valid_lines is not None:
+                gerrit_comments = self._filter_comments(gerrit_comments, valid_lines)
+
             return message, gerrit_comments, vote
 
-        except json.JSONDecodeError as e:
+        except orjson.JSONDecodeError as e:
             logger.error(f"Failed to parse LLM response as JSON. Error: {e}")
             logger.error(f"Raw response was: {raw_content}")
-            return "Failed to parse the automated review results.", {}, -1
+            return PARSE_ERROR_MESSAGE, {}, -1
+
+    def _filter_comments(self, comments, valid_lines):
+        """Keeps only inline comments that target a commentable line of a reviewed file."""
+        filtered = {}
+        for filename, file_comments in comments.items():
+            lines = valid_lines.get(filename, ())
+            kept = [c for c in file_comments if c.get("line") in lines]
+            if len(kept) < len(file_comments):
+                logger.warning(f"Dropping {len(file_comments) - len(kept)} inline comment(s) on invalid lines of {filename}")
+            if kept:
+                filtered[filename] = kept
+        return filtered
@@ -0,0 +1,76 @@
+import functools
+import logging
+import os
+from dataclasses import dataclass
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+@dataclass(frozen=True)
+class Config:
+    """Bot settings, read from the environment by load_config()."""
+
+    # Gerrit connection settings
+    gerrit_ssh_host: str
+    gerrit_ssh_port: int
+    gerrit_rest_url: str
+    gerrit_username: Optional[str]
+    gerrit_ssh_key_path: Optional[str]
+    gerrit_ssh_host_key: Optional[str]
+    gerrit_http_password: Optional[str]
+
+    # LiteLLM settings
+    litellm_proxy_url: Optional[str]
+    llm_model: Optional[str]
+    litellm_api_key: Optional[str]
+    llm_temperature: float
+    llm_max_tokens: int
+    llm_stream: bool
+    llm_cache_system_prompt: bool
+
+    # Bot tweaks
+    review_debounce_seconds: float
+    max_workers: int
+    remove_bot_reviewer: bool
+    verify_ssh_host: bool
+
+def _env_number(name, default, convert):
+    """Reads a numeric env var, falling back to the default if it doesn't parse."""
+    value = os.environ.get(name, default)
+    try:
+        return convert(value)
+    except ValueError:
+        logger.warning(f"Invalid {name} provided. Defaulting to {default}.")
+        return convert(default)
+
+def _env_bool(name, default):
+    return os.environ.get(name, default).lower() in ("true", "1", "yes")
+
+@functools.cache
+def load_config():
+    """Reads and coerces all settings from the environment once; later calls return the same Config.
+
+    Call it after load_dotenv() so values from a .env file are picked up.
+    """
+    return Config(
+        gerrit_ssh_host=os.environ.get("GERRIT_SSH_HOST", "localhost"),
+        gerrit_ssh_port=_env_number("GERRIT_SSH_PORT", "29418", int),
+        gerrit_rest_url=os.environ.get("GERRIT_REST_URL", "http://localhost:8080"),
+        gerrit_username=os.environ.get("GERRIT_USERNAME"),
+        gerrit_ssh_key_path=os.environ.get("GERRIT_SSH_KEY_PATH"),
+        gerrit_ssh_host_key=os.environ.get("GERRIT_SSH_HOST_KEY"),
+        gerrit_http_password=os.environ.get("GERRIT_HTTP_PASSWORD"),
+        # For litellm proxy, we just need the api_base. The model name dictates the provider.
+        litellm_proxy_url=os.environ.get("LITELLM_PROXY_URL"),
+        # The default model string to pass to litellm proxy (e.g. gpt-4, claude-3-opus, gemini-pro)
+        llm_model=os.environ.get("LLM_MODEL"),
+        litellm_api_key=os.environ.get("LITELLM_MASTER_KEY"),
+        llm_temperature=_env_number("LLM_TEMPERATURE", "0.2", float),
+        llm_max_tokens=_env_number("LLM_MAX_TOKENS", "1024", int),
+        llm_stream=_env_bool("LLM_STREAM", "False"),
+        llm_cache_system_prompt=_env_bool("LLM_CACHE_SYSTEM_PROMPT", "False"),
+        review_debounce_seconds=_env_number("REVIEW_DEBOUNCE_SECONDS", "3", float),
+        max_workers=_env_number("MAX_WORKERS", "5", int),
+        remove_bot_reviewer=_env_bool("REMOVE_BOT_REVIEWER", "False"),
+        verify_ssh_host=_env_bool("VERIFY_SSH_HOST", "True"),
+    )
@@ -1,3 +1,4 @@
+import asyncio
 import logging
 
 logger = logging.getLogger(__name__)
@@ -5,14 +6,21 @@ logger = logging.getLogger(__name__)
 class ReviewHandler:
     """Orchestrates the reception of events, fetching of diffs, analysis, and posting of reviews."""
 
-    def __init__(self, bot_username, rest_client, analyzer, remove_after_review=False):
+    def __init__(self, bot_username, rest_client, analyzer, remove_after_review=False, debounce_delay=3.0):
         self.bot_username = bot_username
         self.rest_client = rest_client
         self.analyzer = analyzer
         self.remove_after_review = remove_after_review
+        self.debounce_delay = debounce_delay
+        # Change ID -> review task still inside its debounce window
+        self._pending = {}
 
-    def handle_event(self, event):
-        """Called by the GerritStreamListener when a 'reviewer-added' event occurs."""
+    async def handle_event(self, event):
+        """Called by the GerritStreamListener when a 'reviewer-added' event occurs.
+
+        Runs as a coroutine on the listener's event loop, so concurrent reviews
+        overlap their Gerrit and LLM IO.
+        """
 
         # 1. Validate if the bot was the one added
         reviewer = event.get('reviewer', {})
@@ -36,17 +44,57 @@ class ReviewHandler:
 
         logger.info(f"Bot {self.bot_username} added as reviewer to {project}~{change_id} PS{patchset_num}")
 
-        # Notify Gerrit that the review has started
-        self.rest_client.post_review(
-            project=project,
-            change_id=change_id,
-            revision_id=revision_id,
-            message="Starting automated code review...",
-            code_review_vote=0
+        # Coalesce bursts of events for the same change: a newer event cancels a review
+        # that is still waiting out its debounce window, before any LLM spend.
+        previous = self._pending.get(change_id)
+        if previous:
+            previous.cancel()
+
+        task = asyncio.create_task(self._delayed_review(project, change_id, revision_id, patchset_num))
+        self._pending[change_id] = task
+
+        try:
+            await asyncio.wait({task})
+        except asyncio.CancelledError:
+            task.cancel()
+            raise
+
+        if task.cancelled():
+            logger.info(f"Review of {change_id} PS{patchset_num} superseded by a newer event for the same change.")
+            return
+        task.result()
+
+    async def _delayed_review(self, project, change_id, revision_id, patchset_num):
+        """Waits out the debounce window, then runs the review unless a newer event cancelled it."""
+        try:
+            await asyncio.sleep(self.debounce_delay)
+        finally:
+            # Past the debounce window, newer events no longer cancel this review
+            if self._pending.get(change_id) is asyncio.current_task():
+                del self._pending[change_id]
+
+        await self._review(project, change_id, revision_id, patchset_num)
+
+    async def _review(self, project, change_id, revision_id, patchset_num):
+        """Fetches the diffs of a patchset, analyzes them and posts the review."""
+
+        # 2. Fetch the diffs for this patchset, checking in parallel that it is still the latest one.
+        # The "review started" notice goes out alongside instead of adding a round trip up front.
+        _, (diffs, valid_lines), is_latest = await asyncio.gather(
+            self.rest_client.post_review(
+                project=project,
+                change_id=change_id,
+                revision_id=revision_id,
+                message="Starting automated code review...",
+                code_review_vote=0
+            ),
+            self.rest_client.get_diffs(project, change_id, revision_id),
+            self.rest_client.is_latest_patchset(change_id, revision_id),
         )
 
-        # 2. Fetch the diffs for this patchset
-        diffs = self.rest_client.get_diffs(project, change_id, revision_id)
+        if not is_latest:
+            logger.warning(f"Change {change_id} PS{patchset_num} was already superseded. Skipping review.")
+            return
 
         if not diffs:
             logger.warning(f"No diffs found for {change_id} PS{patchset_num}. Skipping review.")
@@ -56,15 +104,15 @@ class ReviewHandler:
 
         # 3. Analyze the diffs
         # message: str, comments: dict, vote: int
-        message, comments, vote = self.analyzer.analyze(diffs)
+        message, comments, vote = await self.analyzer.analyze(diffs, valid_lines)
 
         # Verify the patchset hasn't been superseded while the LLM was processing
-        if not self.rest_client.is_latest_patchset(change_id, revision_id):
+        if not await self.rest_client.is_latest_patchset(change_id, revision_id):
             logger.warning(f"Change {change_id} PS{patchset_num} was superseded. Discarding review.")
             return
 
         # 4. Post the review back to Gerrit
-        success = self.rest_client.post_review(
+        success = await self.rest_client.post_review(
             project=project,
             change_id=change_id,
             revision_id=revision_id,
@@ -78,7 +126,7 @@ class ReviewHandler:
             
             # 5. Remove bot from the reviewer list (optional)
             if self.remove_after_review:
-                remove_success = self.rest_client.remove_reviewer(project, change_id, self.bot_username)
+                remove_success = await self.rest_client.remove_reviewer(project, change_id, self.bot_username)
                 if remove_success:
                     logger.info(f"Successfully removed {self.bot_username} from reviewers on {change_id}")
                 else:
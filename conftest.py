@@ -0,0 +1,2 @@
+# Placing a conftest.py at the repository root makes pytest add the root to sys.path,
+# so tests can import the top-level packages (analyzer, bot, gerrit) directly.
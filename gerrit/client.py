@@ -1,121 +1,224 @@
-import requests
+import asyncio
+import base64
+import httpx
 import logging
-from requests.auth import HTTPBasicAuth
 from urllib.parse import quote_plus, quote
-import concurrent.futures
-import json
+import orjson
+import re
+from collections import OrderedDict
 
 logger = logging.getLogger(__name__)
 
+MAGIC_PREFIX = b")]}'\n"
+
+# Unified diff hunk header, e.g. "@@ -10,7 +10,8 @@ def foo():"
+_HUNK_RE = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@")
+
+# Files not worth an LLM review, matched in one pass: the commit message pseudo-file,
+# binary/asset extensions and generated lockfiles
+_SKIP_RE = re.compile(
+    r'^/COMMIT_MSG$'
+    r'|\.(?:png|jpe?g|gif|ico|pdf|zip|tar|gz|pyc|class|exe|dll|so|dylib|woff2?|ttf)$'
+    r'|(?:^|/)(?:package-lock\.json|yarn\.lock|pnpm-lock\.yaml|poetry\.lock|Cargo\.lock|go\.sum|Gemfile\.lock)$'
+)
+
+# C-style escapes git uses in quoted paths (core.quotePath): a 3-digit octal byte or a single character
+_QUOTED_ESCAPE_RE = re.compile(rb'\\([0-7]{3}|.)')
+_QUOTED_ESCAPES = {
+    b'a': b'\a', b'b': b'\b', b't': b'\t', b'n': b'\n', b'v': b'\v',
+    b'f': b'\f', b'r': b'\r', b'"': b'"', b'\\': b'\\',
+}
+
+def _unescape_quoted(match):
+    escape = match.group(1)
+    if len(escape) == 3:
+        return bytes([int(escape, 8)])
+    return _QUOTED_ESCAPES.get(escape, escape)
+
 class GerritRestClient:
     """Wrapper for Gerrit REST API interactions."""
 
-    def __init__(self, base_url, username, password, timeout=30, max_workers=5):
-        from requests.adapters import HTTPAdapter
+    def __init__(self, base_url, username, password, timeout=30, diff_cache_size=512, patch_cache_size=64):
         self.base_url = base_url.rstrip('/')
-        self.auth = HTTPBasicAuth(username, password)
-        self.max_workers = max_workers
-        self._session = requests.Session()
-        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
-        self._session.mount('http://', adapter)
-        self._session.mount('https://', adapter)
-        self._session.auth = self.auth
+        self.auth = httpx.BasicAuth(username, password)
         self.timeout = timeout
+        # HTTP/2 multiplexes the per-file diff requests over a single connection when the server supports it
+        self._client = httpx.AsyncClient(
+            http2=True,
+            auth=self.auth,
+            limits=httpx.Limits(max_connections=50, max_keepalive_connections=20),
+            timeout=timeout,
+        )
+        # A (revision, file) diff is immutable in Gerrit, so formatted diffs survive bot re-adds.
+        # The revision SHA is globally unique, so the change ID is not part of the key.
+        self.diff_cache_size = diff_cache_size
+        # Same idea for whole revision patches, keyed by revision SHA
+        self.patch_cache_size = patch_cache_size
+        # Only touched from the review event loop, so no lock is needed
+        self._diff_cache = OrderedDict()
+        self._patch_cache = OrderedDict()
+
+    def _loads(self, response):
+        """Decodes a Gerrit JSON response body.
 
-    def _strip_magic_prefix(self, response_text):
-        """Gerrit prefixes JSON responses with a magic string to prevent CSRF.
+        Gerrit prefixes JSON responses with a magic string to prevent CSRF.
         See: https://gerrit-review.googlesource.com/Documentation/rest-api.html#output
+        The prefix is skipped through a memoryview so large payloads aren't copied.
         """
-        prefix = ")]}'\n"
-        if response_text.startswith(prefix):
-            return response_text[len(prefix):]
-        return response_text
+        body = response.content
+        if body.startswith(MAGIC_PREFIX):
+            return orjson.loads(memoryview(body)[len(MAGIC_PREFIX):])
+        return orjson.loads(body)
 
-    def get_diffs(self, project, change_id, revision_id):
+    async def get_diffs(self, project, change_id, revision_id):
         """
         Fetches the patchset details, including the files changed and their diffs.
-        Returns a dictionary mapping file paths to their diff content.
+
+        The whole revision is fetched as a single patch (one round trip regardless of
+        the number of files); if that fails, each file's diff is fetched individually.
+
+        Returns:
+            tuple: (diffs: dict mapping file paths to their diff content,
+                    valid_lines: dict mapping file paths to the set of new-side line
+                    numbers that can carry inline comments)
         """
         change_identifier = str(change_id)
 
+        patch_files = self._patch_cache.get(revision_id)
+        if patch_files is not None:
+            self._patch_cache.move_to_end(revision_id)
+        else:
+            patch_files = await self._fetch_patch(change_identifier, revision_id)
+            if not patch_files:
+                return await self._get_diffs_per_file(change_identifier, revision_id)
+            self._cache_patch(revision_id, patch_files)
+
+        diffs = {}
+        valid_lines = {}
+        for filename, formatted in patch_files.items():
+            if self._is_ignored(filename):
+                continue
+            diffs[filename], valid_lines[filename] = formatted
+
+        return diffs, valid_lines
+
+    async def _fetch_patch(self, change_identifier, revision_id):
+        """
+        Fetches the revision as one unified patch and splits it per file.
+        Returns a dict of filename -> (diff, valid_lines), or None if the patch is unavailable.
+        """
+        # GET /a/changes/{change-id}/revisions/{revision-id}/patch (base64-encoded)
+        patch_url = f"{self.base_url}/a/changes/{change_identifier}/revisions/{revision_id}/patch"
+        try:
+            rv = await self._client.get(patch_url)
+            rv.raise_for_status()
+            patch_text = base64.b64decode(rv.content).decode("utf-8", errors="replace")
+            return self._parse_patch(patch_text)
+        except Exception as e:
+            logger.warning(f"Failed to fetch patch for change {change_identifier}, falling back to per-file diffs: {e}")
+            return None
+
+    async def _get_diffs_per_file(self, change_identifier, revision_id):
+        """Fetches the list of changed files, then each file's diff in parallel."""
         # 1. Fetch the list of files changed in this revision
         # GET /a/changes/{change-id}/revisions/{revision-id}/files/
         files_url = f"{self.base_url}/a/changes/{change_identifier}/revisions/{revision_id}/files/"
         try:
-            rv = self._session.get(files_url, timeout=self.timeout)
+            rv = await self._client.get(files_url)
             rv.raise_for_status()
-            files_data = json.loads(self._strip_magic_prefix(rv.text))
+            files_data = self._loads(rv)
         except Exception as e:
             logger.error(f"Failed to fetch files for change {change_identifier}: {e}")
-            return {}
+            return {}, {}
 
         diffs = {}
+        valid_lines = {}
         
-        IGNORE_EXTENSIONS = {
-            '.png', '.jpg', '.jpeg', '.gif', '.ico', '.pdf', '.zip', '.tar', '.gz', 
-            '.pyc', '.class', '.exe', '.dll', '.so', '.dylib', '.woff', '.woff2', '.ttf'
-        }
-        IGNORE_FILES = {
-            'package-lock.json', 'yarn.lock', 'pnpm-lock.yaml', 
-            'poetry.lock', 'Cargo.lock', 'go.sum', 'Gemfile.lock'
-        }
-
-        filenames = []
-        for f in files_data.keys():
-            if f == "/COMMIT_MSG":
-                continue
-            if any(f.endswith(ext) for ext in IGNORE_EXTENSIONS):
-                logger.debug(f"Skipping binary/ignored extension: {f}")
-                continue
-            if f.split('/')[-1] in IGNORE_FILES:
-                logger.debug(f"Skipping generated lockfile: {f}")
-                continue
-            filenames.append(f)
-
-        def fetch_single_diff(filename):
-            # Encode filename carefully for Gerrit REST API
-            encoded_filename = quote(filename, safe="")
-
-            # 2. Fetch the diff for each file
-            # GET /a/changes/{change-id}/revisions/{revision-id}/files/{file-id}/diff
-            diff_url = f"{self.base_url}/a/changes/{change_identifier}/revisions/{revision_id}/files/{encoded_filename}/diff"
-            try:
-                drv = self._session.get(diff_url, timeout=self.timeout)
-                drv.raise_for_status()
-                diff_data = json.loads(self._strip_magic_prefix(drv.text))
-                
-                # Format the diff content to be LLM readable.
-                return filename, self._format_diff(diff_data)
-            except Exception as e:
-                logger.error(f"Failed to fetch diff for file {filename}: {e}")
-                return filename, None
+        filenames = [f for f in files_data.keys() if not self._is_ignored(f)]
 
         # Fetch in parallel
-        with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
-            future_to_file = {executor.submit(fetch_single_diff, f): f for f in filenames}
-            for future in concurrent.futures.as_completed(future_to_file):
-                filename, diff_content = future.result()
-                if diff_content:
-                    diffs[filename] = diff_content
+        results = await asyncio.gather(
+            *[self._fetch_single_diff(change_identifier, revision_id, f) for f in filenames]
+        )
+        for filename, formatted in results:
+            if formatted and formatted[0]:
+                diffs[filename], valid_lines[filename] = formatted
         
-        return diffs
+        return diffs, valid_lines
+
+    def _is_ignored(self, filename):
+        """True for the commit message, binaries and generated lockfiles, which are not worth an LLM review."""
+        if _SKIP_RE.search(filename):
+            logger.debug(f"Skipping ignored file: {filename}")
+            return True
+        return False
+
+    async def _fetch_single_diff(self, change_identifier, revision_id, filename):
+        """Fetches and formats the diff of one file, returning (filename, (diff, valid_lines) or None)."""
+        cached = self._get_cached_diff(revision_id, filename)
+        if cached is not None:
+            return filename, cached
+
+        # Encode filename carefully for Gerrit REST API
+        encoded_filename = quote(filename, safe="")
+
+        # 2. Fetch the diff for each file
+        # GET /a/changes/{change-id}/revisions/{revision-id}/files/{file-id}/diff
+        diff_url = f"{self.base_url}/a/changes/{change_identifier}/revisions/{revision_id}/files/{encoded_filename}/diff"
+        try:
+            drv = await self._client.get(diff_url)
+            drv.raise_for_status()
+            diff_data = self._loads(drv)
+            
+            # Format the diff content to be LLM readable.
+            formatted = self._format_diff(diff_data)
+            self._cache_diff(revision_id, filename, formatted)
+            return filename, formatted
+        except Exception as e:
+            logger.error(f"Failed to fetch diff for file {filename}: {e}")
+            return filename, None
 
-    def is_latest_patchset(self, change_id, revision_id):
+    def _get_cached_diff(self, revision_id, filename):
+        key = (revision_id, filename)
+        formatted = self._diff_cache.get(key)
+        if formatted is not None:
+            self._diff_cache.move_to_end(key)
+        return formatted
+
+    def _cache_diff(self, revision_id, filename, formatted):
+        if self.diff_cache_size <= 0:
+            return
+
+        self._diff_cache[(revision_id, filename)] = formatted
+        self._diff_cache.move_to_end((revision_id, filename))
+        while len(self._diff_cache) > self.diff_cache_size:
+            self._diff_cache.popitem(last=False)
+
+    def _cache_patch(self, revision_id, patch_files):
+        if self.patch_cache_size <= 0:
+            return
+
+        self._patch_cache[revision_id] = patch_files
+        self._patch_cache.move_to_end(revision_id)
+        while len(self._patch_cache) > self.patch_cache_size:
+            self._patch_cache.popitem(last=False)
+
+    async def is_latest_patchset(self, change_id, revision_id):
         """
         Checks if the provided revision_id is the current/latest patchset for the change.
         """
         change_identifier = str(change_id)
         url = f"{self.base_url}/a/changes/{change_identifier}?o=CURRENT_REVISION"
         try:
-            rv = self._session.get(url, timeout=self.timeout)
+            rv = await self._client.get(url)
             rv.raise_for_status()
-            data = json.loads(self._strip_magic_prefix(rv.text))
+            data = self._loads(rv)
             return data.get("current_revision") == revision_id
         except Exception as e:
             logger.error(f"Failed to fetch change details for {change_identifier}: {e}")
             return False
 
-    def post_review(self, project, change_id, revision_id, message, comments=None, code_review_vote=0):
+    async def post_review(self, project, change_id, revision_id, message, comments=None, code_review_vote=0):
         """
         Posts a review to the specified patchset.
 
@@ -142,10 +245,10 @@ class GerritRestClient:
 
         logger.info(f"Posting review to {change_identifier}, vote={code_review_vote}")
         try:
-            rv = self._session.post(review_url, json=payload, timeout=self.timeout)
+            rv = await self._client.post(review_url, json=payload)
             rv.raise_for_status()
             return True
-        except requests.exceptions.HTTPError as e:
+        except httpx.HTTPStatusError as e:
             logger.error(f"Failed to post review. HTTP Error: {e.response.text}")
             return False
         except Exception as e:
@@ -153,13 +256,20 @@ class GerritRestClient:
             return False
 
     def _format_diff(self, diff_data):
-        """Helper to convert Gerrit diff JSON into unified-diff like string with line numbers."""
+        """
+        Helper to convert Gerrit diff JSON into unified-diff like string with line numbers.
+
+        Returns:
+            tuple: (formatted: str, valid_lines: set of new-side line numbers shown as
+                    added or unchanged, i.e. the lines Gerrit accepts inline comments on)
+        """
         formatted = []
+        valid_lines = set()
         if 'diff_header' in diff_data:
             formatted.append("\n".join(diff_data['diff_header']))
         
         if 'content' not in diff_data:
-            return "\n".join(formatted)
+            return "\n".join(formatted), valid_lines
 
         line_a = 1
         line_b = 1
@@ -171,31 +281,145 @@ class GerritRestClient:
                 line_a += skip_count
                 line_b += skip_count
                 formatted.append(f"... skipped {skip_count} lines ...")
-            elif 'ab' in chunk or 'a' in chunk or 'b' in chunk:
-                # Calculate lengths for unified diff header
-                len_a = len(chunk.get('ab', [])) + len(chunk.get('a', []))
-                len_b = len(chunk.get('ab', [])) + len(chunk.get('b', []))
-                formatted.append(f"@@ -{line_a},{len_a} +{line_b},{len_b} @@")
-
-                if 'ab' in chunk: # lines that are common to both sides
-                    for line in chunk['ab']:
-                        formatted.append(f" {line_b:4d} |  {line}")
-                        line_a += 1
-                        line_b += 1
-
-                if 'a' in chunk: # lines present in 'a' but removed in 'b'
-                    for line in chunk['a']:
-                        formatted.append(f"      | -{line}")
-                        line_a += 1
-
-                if 'b' in chunk: # lines added to 'b'
-                    for line in chunk['b']:
-                        formatted.append(f" {line_b:4d} | +{line}")
-                        line_b += 1
-
-        return "\n".join(formatted)
-
-    def remove_reviewer(self, project, change_id, account_id):
+                continue
+
+            ab = chunk.get('ab') # lines that are common to both sides
+            a = chunk.get('a')   # lines present in 'a' but removed in 'b'
+            b = chunk.get('b')   # lines added to 'b'
+            if ab is None and a is None and b is None:
+                continue
+
+            # Calculate lengths for unified diff header
+            len_ab = len(ab) if ab else 0
+            len_a = len(a) if a else 0
+            len_b = len(b) if b else 0
+            formatted.append(f"@@ -{line_a},{len_ab + len_a} +{line_b},{len_ab + len_b} @@")
+
+            # Format each run in bulk and advance the counters once per run instead of per line
+            if ab:
+                formatted.extend(f" {n:4d} |  {line}" for n, line in zip(range(line_b, line_b + len_ab), ab))
+                valid_lines.update(range(line_b, line_b + len_ab))
+                line_a += len_ab
+                line_b += len_ab
+
+            if a:
+                formatted.extend(f"      | -{line}" for line in a)
+                line_a += len_a
+
+            if b:
+                formatted.extend(f" {n:4d} | +{line}" for n, line in zip(range(line_b, line_b + len_b), b))
+                valid_lines.update(range(line_b, line_b + len_b))
+                line_b += len_b
+
+        return "\n".join(formatted), valid_lines
+
+    def _parse_patch(self, patch_text):
+        """
+        Splits a git-format unified patch into per-file diffs, formatted like _format_diff.
+
+        Returns:
+            dict: filename -> (formatted: str, valid_lines: set of new-side line numbers)
+        """
+        files = {}
+        formatted = valid_lines = None
+        old_path = new_path = None
+        line_a = line_b = 1
+        remaining_a = remaining_b = 0
+
+        def finish():
+            path = new_path or old_path
+            if formatted is not None and path:
+                files[path] = ("\n".join(formatted), valid_lines)
+
+        for line in patch_text.split("\n"):
+            if line.startswith("diff --git "):
+                finish()
+                formatted = [line]
+                valid_lines = set()
+                old_path = new_path = None
+                line_a = line_b = 1
+                remaining_a = remaining_b = 0
+                continue
+
+            if formatted is None:
+                # Commit message preamble before the first file
+                continue
+
+            if remaining_a > 0 or remaining_b > 0:
+                marker, content = line[:1], line[1:]
+                if marker in (" ", ""):
+                    # Blank lines are context lines whose trailing space was stripped
+                    formatted.append(f" {line_b:4d} |  {content}")
+                    valid_lines.add(line_b)
+                    line_a += 1
+                    line_b += 1
+                    remaining_a -= 1
+                    remaining_b -= 1
+                elif marker == "-":
+                    formatted.append(f"      | -{content}")
+                    line_a += 1
+                    remaining_a -= 1
+                elif marker == "+":
+                    formatted.append(f" {line_b:4d} | +{content}")
+                    valid_lines.add(line_b)
+                    line_b += 1
+                    remaining_b -= 1
+                # "\ No newline at end of file" and anything else carries no line
+                continue
+
+            hunk = _HUNK_RE.match(line)
+            if hunk:
+                start_a, count_a, start_b, count_b = hunk.groups()
+                start_a = int(start_a)
+                start_b = int(start_b)
+                if start_b > line_b:
+                    formatted.append(f"... skipped {start_b - line_b} lines ...")
+                line_a = start_a
+                line_b = start_b
+                remaining_a = int(count_a) if count_a is not None else 1
+                remaining_b = int(count_b) if count_b is not None else 1
+                formatted.append(line)
+            elif line.startswith("--- "):
+                old_path = self._patch_path(line[4:])
+                formatted.append(line)
+            elif line.startswith("+++ "):
+                new_path = self._patch_path(line[4:])
+                formatted.append(line)
+            elif line.startswith("rename to "):
+                new_path = self._unquote_path(line[len("rename to "):])
+                formatted.append(line)
+            elif line.startswith(("Binary files ", "GIT binary patch")):
+                # Nothing an LLM can review
+                formatted = None
+            elif line == "-- " or line == "--":
+                # format-patch signature: nothing after it belongs to a file
+                finish()
+                formatted = None
+            elif line:
+                # Extended headers (index, mode, rename from, ...)
+                formatted.append(line)
+
+        finish()
+        return files
+
+    def _patch_path(self, path):
+        """Strips the a/ or b/ prefix from a patch file path; /dev/null means no file on that side."""
+        path = self._unquote_path(path.split("\t")[0])
+        if path == "/dev/null":
+            return None
+        if path.startswith(("a/", "b/")):
+            return path[2:]
+        return path
+
+    def _unquote_path(self, path):
+        """Undoes git's quoting of unusual paths, e.g. "b/d\\303\\251j\\303\\240.py" -> b/déjà.py."""
+        if len(path) < 2 or not (path.startswith('"') and path.endswith('"')):
+            return path
+        # Octal escapes are UTF-8 bytes, so unescape at the byte level and decode once
+        raw = _QUOTED_ESCAPE_RE.sub(_unescape_quoted, path[1:-1].encode("utf-8"))
+        return raw.decode("utf-8", errors="replace")
+
+    async def remove_reviewer(self, project, change_id, account_id):
         """
         Removes a reviewer from a change.
 
@@ -211,10 +435,10 @@ class GerritRestClient:
 
         logger.info(f"Removing reviewer {account_id} from {change_identifier}")
         try:
-            rv = self._session.delete(url, timeout=self.timeout)
+            rv = await self._client.delete(url)
             rv.raise_for_status()
             return True
-        except requests.exceptions.HTTPError as e:
+        except httpx.HTTPStatusError as e:
             logger.error(f"Failed to remove reviewer. HTTP Error: {e.response.text}")
             return False
         except Exception as e:
@@ -1,14 +1,28 @@
-import json
+import asyncio
 import logging
-import concurrent.futures
+import random
+import selectors
 import time
 import base64
+import os
 import socket
+import orjson
 import paramiko
 import threading
 
 logger = logging.getLogger(__name__)
 
+# Maximum bytes drained from the stream-events channel per read
+STREAM_READ_BUFSIZE = 65536
+# SSH keepalives detect a dead peer, which closes the channel, so stream reads need no timeout
+SSH_KEEPALIVE_INTERVAL = 30
+# Events older than this (seconds) are replayed history and are discarded
+STALE_EVENT_AGE = 300
+# How often (seconds) a run of discarded stale events is summarized in the log
+STALE_SUMMARY_INTERVAL = 60
+# Appears in every reviewer-added event line, as the value of "type"
+REVIEWER_ADDED_MARKER = b'"reviewer-added"'
+
 class GerritStreamListener:
     def __init__(self, host, port, username, key_filename, event_handler, host_key=None, verify_host_key=True, max_workers=5):
         """
@@ -20,9 +34,9 @@ class GerritStreamListener:
             username (str): Bot username.
             key_filename (str): Path to the SSH private key.
             host_key (str): Optional base64-encoded ED25519 known host key for the Gerrit server.
-            event_handler (callable): Function to call with parsed event payload.
+            event_handler (callable): Coroutine function to call with parsed event payload.
             verify_host_key (bool): Whether to enforce SSH host key verification.
-            max_workers (int): Maximum number of concurrent event processing threads.
+            max_workers (int): Maximum number of reviews processed concurrently.
         """
         self.host = host
         self.port = port
@@ -33,43 +47,73 @@ class GerritStreamListener:
         self.verify_host_key = verify_host_key
         self._running = False
         self._ssh_client = None
-        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
-        self._active_reviews = set()
-        self._lock = threading.Lock()
+        # Known hosts are read and the configured host key decoded once here, then shared
+        # by every client created on reconnect
+        self._system_host_keys = self._load_system_host_keys()
+        self._host_keys = paramiko.HostKeys()
+        parsed_host_key = self._parse_host_key(host_key) if host_key else None
+        if parsed_host_key:
+            key_name = parsed_host_key.get_name()
+            self._host_keys.add(host, key_name, parsed_host_key)
+            # Also add for specific port if not using default 22
+            self._host_keys.add(f"[{host}]:{port}", key_name, parsed_host_key)
+        self.max_workers = max_workers
+        # Event handlers run as coroutines on a shared loop in a background thread,
+        # so the blocking SSH read loop never waits on a review.
+        self._loop = asyncio.new_event_loop()
+        self._loop_thread = threading.Thread(target=self._loop.run_forever, name="review-loop", daemon=True)
+        self._loop_thread.start()
+        # A fixed pool of max_workers worker coroutines drains the review queue; both are
+        # created on the loop thread so they bind to the review loop
+        self._queue = None
+        self._workers = []
+        self._loop.call_soon_threadsafe(self._start_workers)
+        # Review ID -> event being reviewed. Only touched via setdefault/pop, which are
+        # atomic under the GIL, so the reader and loop threads need no lock around it.
+        self._active_reviews = {}
+        # Reviews queued or running beyond this are dropped rather than piling up on a stalled loop
+        self._max_backlog = max_workers * 4
+        # Stale events discarded since _stale_since (the last one read at _stale_last_at),
+        # only touched by the reader thread
+        self._stale_discarded = 0
+        self._stale_since = 0.0
+        self._stale_last_at = 0.0
+
+    @staticmethod
+    def _load_system_host_keys():
+        """Reads the user's known_hosts file, as SSHClient.load_system_host_keys does."""
+        host_keys = paramiko.HostKeys()
+        try:
+            host_keys.load(os.path.expanduser("~/.ssh/known_hosts"))
+        except IOError:
+            pass
+        return host_keys
+
+    @staticmethod
+    def _parse_host_key(host_key):
+        """Decodes the configured host key into a paramiko key, or returns None if it can't be parsed."""
+        # The host_key string could be a raw base64 string, or a full known_hosts line (e.g. "ssh-rsa AAA...")
+        parts = host_key.strip().split()
+        key_data_b64 = parts[1] if len(parts) > 1 else parts[0]
+
+        try:
+            key_bytes = base64.b64decode(key_data_b64)
+            # The key blob starts with its own type name, so a bare base64 key needs no prefix
+            key_type = parts[0] if len(parts) > 1 else paramiko.Message(key_bytes).get_text()
+            parsed_key = paramiko.PKey.from_type_string(key_type, key_bytes)
+        except Exception as e:
+            logger.warning("Error parsing provided host key: %s", e)
+            return None
+
+        logger.info("Successfully loaded provided %s host key.", parsed_key.get_name())
+        return parsed_key
 
     def connect(self):
         """Establishes an SSH connection to Gerrit."""
         self._ssh_client = paramiko.SSHClient()
-        self._ssh_client.load_system_host_keys()
-
-        if self.host_key:
-            # The host_key string could be a raw base64 string, or a full known_hosts line (e.g. "ssh-rsa AAA...")
-            parts = self.host_key.strip().split()
-            key_data_b64 = parts[1] if len(parts) > 1 else parts[0]
-            
-            try:
-                key_bytes = base64.b64decode(key_data_b64)
-                parsed_key = None
-                
-                # Attempt to decode using available paramiko key classes
-                for key_class in [paramiko.Ed25519Key, paramiko.ECDSAKey, paramiko.RSAKey, paramiko.DSSKey]:
-                    try:
-                        parsed_key = key_class(data=key_bytes)
-                        break
-                    except Exception:
-                        continue
-                
-                if parsed_key:
-                    key_name = parsed_key.get_name()
-                    self._ssh_client.get_host_keys().add(self.host, key_name, parsed_key)
-                    # Also add for specific port if not using default 22
-                    self._ssh_client.get_host_keys().add(f"[{self.host}]:{self.port}", key_name, parsed_key)
-                    logger.info(f"Successfully loaded provided {key_name} host key.")
-                else:
-                    logger.warning("Failed to decode provided host key into any known SSH format (Ed25519, ECDSA, RSA, DSS).")
-
-            except Exception as e:
-                logger.warning(f"Error parsing provided host key: {e}")
+        # SSHClient has no public setter for these, and the load_* methods would re-read the file
+        self._ssh_client._system_host_keys = self._system_host_keys
+        self._ssh_client._host_keys = self._host_keys
 
         if self.verify_host_key:
             self._ssh_client.set_missing_host_key_policy(paramiko.RejectPolicy())
@@ -78,7 +122,7 @@ class GerritStreamListener:
             self._ssh_client.set_missing_host_key_policy(paramiko.WarningPolicy())
 
         try:
-            logger.info(f"Connecting to SSH at {self.username}@{self.host}:{self.port}")
+            logger.info("Connecting to SSH at %s@%s:%s", self.username, self.host, self.port)
             self._ssh_client.connect(
                 hostname=self.host,
                 port=self.port,
@@ -87,12 +131,26 @@ class GerritStreamListener:
                 look_for_keys=False,
                 allow_agent=False
             )
+            transport = self._ssh_client.get_transport()
+            self._tune_socket(transport.sock)
+            transport.set_keepalive(SSH_KEEPALIVE_INTERVAL)
             logger.info("SSH connection established successfully.")
             return True
         except Exception as e:
-            logger.error(f"Failed to connect to Gerrit SSH: {e}")
+            logger.error("Failed to connect to Gerrit SSH: %s", e)
             return False
 
+    @staticmethod
+    def _tune_socket(sock):
+        """Disables Nagle and enables TCP keepalive on the SSH socket."""
+        # stream-events sends small, irregular lines; Nagle plus delayed ACKs would hold them back
+        try:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        except (AttributeError, OSError) as e:
+            # Not a plain TCP socket (e.g. a proxy command); nothing to tune
+            logger.debug("Could not set socket options on SSH transport: %s", e)
+
     def start_listening(self):
         """Starts listening to 'gerrit stream-events'."""
         self._running = True
@@ -102,99 +160,174 @@ class GerritStreamListener:
 
         while self._running:
             if not self.connect():
-                logger.info(f"Retrying connection in {retry_delay} seconds...")
-                time.sleep(retry_delay)
+                # Full jitter: sleep anywhere up to the current ceiling so that clients
+                # dropped by the same outage don't reconnect in lock-step
+                delay = random.uniform(0, retry_delay)
+                logger.info("Retrying connection in %.1f seconds...", delay)
+                time.sleep(delay)
                 retry_delay = min(retry_delay * 2, max_retry_delay)
                 continue
 
             # Connection successful, reset backoff
             retry_delay = base_retry_delay
-            stdin = stdout = stderr = None
+            chan = selector = None
             try:
-                # Execute stream-events command
-                # We use exec_command which returns stdin, stdout, stderr
-                stdin, stdout, stderr = self._ssh_client.exec_command('gerrit stream-events')
+                # Execute stream-events command on a bare session channel. stderr is merged into
+                # stdout instead of being buffered separately, since nothing ever reads it.
+                chan = self._ssh_client.get_transport().open_session()
+                chan.set_combine_stderr(True)
+                chan.exec_command('gerrit stream-events')
 
-                logger.info("Listening to Gerrit stream-events...")
+                # Wait for data with a selector, then drain whatever has arrived in one recv
+                selector = selectors.DefaultSelector()
+                selector.register(chan, selectors.EVENT_READ)
 
-                # stdout is an iterator of lines
-                for line in stdout:
-                    if not self._running:
-                        break
+                logger.info("Listening to Gerrit stream-events...")
 
-                    line = line.strip()
-                    if not line:
+                pending = b''
+                while self._running:
+                    # A quiet stream is normal; a dead connection closes the channel, which wakes
+                    # the selector and reads as EOF below. The only timeout is to report a run of
+                    # stale events once the stream goes quiet after it.
+                    timeout = STALE_SUMMARY_INTERVAL if self._stale_discarded else None
+                    if not selector.select(timeout=timeout):
+                        self._log_stale_summary()
                         continue
 
-                    try:
-                        event = json.loads(line)
-                        self._process_event(event)
-                    except json.JSONDecodeError as e:
-                        logger.error(f"Failed to decode JSON event: {e}. Raw line: {line}")
-                    except Exception as e:
-                        logger.error(f"Error processing event: {e}", exc_info=True)
+                    data = chan.recv(STREAM_READ_BUFSIZE)
+                    if not data:
+                        logger.info("Gerrit closed the stream-events channel.")
+                        break
+
+                    pending = self._handle_data(pending, data, time.time())
 
             except (socket.timeout, TimeoutError):
-                # This is normal since we enforce a 60s timeout on the exec_command socket reading
-                logger.debug("Stream socket timeout reached. Reconnecting to keep underlying TCP session alive...")
+                # A channel operation timed out; start over on a fresh session
+                logger.warning("Stream socket timeout reached. Reconnecting...")
             except paramiko.SSHException as e:
-                logger.error(f"SSH Exception occurred: {e}. Reconnecting...")
+                logger.error("SSH Exception occurred: %s. Reconnecting...", e)
             except Exception as e:
                 # Log the actual class name to make debugging easier for bare exceptions
-                logger.error(f"Unexpected error in stream loop: {e.__class__.__name__}({e}). Reconnecting...")
+                logger.error("Unexpected error in stream loop: %s(%s). Reconnecting...", e.__class__.__name__, e)
             finally:
                 # Explicitly close streams to prevent dangling resources on the server
-                if stdin:
-                    stdin.close()
-                if stdout:
-                    stdout.close()
-                if stderr:
-                    stderr.close()
+                if selector:
+                    selector.close()
+                if chan:
+                    chan.close()
                 
                 if self._ssh_client:
                     self._ssh_client.close()
 
             if self._running:
-                logger.info(f"Reconnecting in {retry_delay} seconds...")
-                time.sleep(retry_delay)
+                delay = random.uniform(0, retry_delay)
+                logger.info("Reconnecting in %.1f seconds...", delay)
+                time.sleep(delay)
+
+    def _handle_data(self, pending, data, now):
+        """Handles every complete line in a received chunk and returns the trailing partial line."""
+        # A burst of events arrives in one recv; split it in memory and carry any
+        # partial last line over to the next read
+        lines = (pending + data).split(b'\n')
+        pending = lines.pop()
+        for line in lines:
+            self._handle_line(line, now)
+
+        # No stale lines in this chunk means a replayed backlog is over; report it now
+        if self._stale_discarded and self._stale_last_at != now:
+            self._log_stale_summary()
+        return pending
+
+    def _handle_line(self, line, now):
+        """Parses one stream-events line and processes it if it may be a reviewer-added event."""
+        # Only reviewer-added events are acted on; skip the rest (the bulk of the
+        # stream on a busy server) with a substring scan instead of a full parse
+        if REVIEWER_ADDED_MARKER not in line:
+            return
+
+        try:
+            # orjson parses the raw bytes directly, no decode step needed
+            event = orjson.loads(line)
+            self._process_event(event, now)
+        except orjson.JSONDecodeError as e:
+            logger.error("Failed to decode JSON event: %s. Raw line: %s", e, line.rstrip().decode('utf-8', 'replace'))
+        except Exception as e:
+            logger.error("Error processing event: %s", e, exc_info=True)
 
     def stop(self):
         """Stops the listener."""
         self._running = False
         if self._ssh_client:
             self._ssh_client.close()
-        self._executor.shutdown(wait=False)
+        asyncio.run_coroutine_threadsafe(self._stop_workers(), self._loop)
         logger.info("Stream listener stopped.")
 
-    def _process_event(self, event):
-        """Filters and routes the event."""
+    def _process_event(self, event, now):
+        """Filters and routes the event. `now` is the time the event's line was read."""
         # Check for stale events to prevent processing backlog if the bot reconnects
         event_created_on = event.get('eventCreatedOn')
-        if event_created_on:
-            age = time.time() - event_created_on
-            if age > 300: # Discard events older than 5 minutes
-                logger.debug(f"Discarding stale event ({age:.1f}s old).")
-                return
+        if event_created_on and now - event_created_on > STALE_EVENT_AGE:
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Discarding stale event (%.1fs old).", now - event_created_on)
+            # A replayed backlog can be large, so it is reported as a count rather than per event
+            if not self._stale_discarded:
+                self._stale_since = now
+            self._stale_discarded += 1
+            self._stale_last_at = now
+            if now - self._stale_since >= STALE_SUMMARY_INTERVAL:
+                self._log_stale_summary()
+            return
 
         event_type = event.get('type')
         if event_type == 'reviewer-added':
             change_num = event.get('change', {}).get('number')
             patchset_num = event.get('patchSet', {}).get('number')
             # Create a unique identifier for this specific patchset review
-            review_id = f"{change_num}-{patchset_num}"
+            review_id = (change_num, patchset_num)
 
-            with self._lock:
-                if review_id in self._active_reviews:
-                    logger.debug(f"Skipping duplicate reviewer-added event for change {change_num} PS {patchset_num}.")
-                    return
+            if len(self._active_reviews) >= self._max_backlog:
+                logger.warning("Review backlog full (%d in flight). Dropping reviewer-added event for change %s PS %s.", len(self._active_reviews), change_num, patchset_num)
+                return
+
+            if self._active_reviews.setdefault(review_id, event) is not event:
+                logger.debug("Skipping duplicate reviewer-added event for change %s PS %s.", change_num, patchset_num)
+                return
+
+            logger.debug("Received reviewer-added event for change %s PS %s", change_num, patchset_num)
+
+            # Hand the event to the review loop so we don't block reading from the stream
+            self._loop.call_soon_threadsafe(self._enqueue, event, review_id)
 
-                logger.debug(f"Received reviewer-added event for change {change_num} PS {patchset_num}")
-                self._active_reviews.add(review_id)
+    def _log_stale_summary(self):
+        """Logs how many stale events were discarded since the last summary and resets the count."""
+        if not self._stale_discarded:
+            return
+        logger.info("Discarded %d stale events read over %.0fs.", self._stale_discarded, self._stale_last_at - self._stale_since)
+        self._stale_discarded = 0
 
-            def finalize_event(f, rid=review_id):
-                with self._lock:
-                    self._active_reviews.discard(rid)
+    def _start_workers(self):
+        """Creates the review queue and its worker coroutines. Runs on the loop thread."""
+        self._queue = asyncio.Queue()
+        self._workers = [self._loop.create_task(self._worker()) for _ in range(self.max_workers)]
 
-            # Run the handler in the thread pool so we don't block reading from the stream
-            future = self._executor.submit(self.event_handler, event)
-            future.add_done_callback(finalize_event)
+    async def _stop_workers(self):
+        """Cancels the workers, along with any review they are running, then stops the loop."""
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._loop.stop()
+
+    def _enqueue(self, event, review_id):
+        """Queues an event for review. Runs on the loop thread, always after _start_workers."""
+        self._queue.put_nowait((event, review_id))
+
+    async def _worker(self):
+        """Runs queued events through the event handler, one at a time, for the life of the listener."""
+        while True:
+            event, review_id = await self._queue.get()
+            try:
+                await self.event_handler(event)
+            except Exception as e:
+                logger.error("Error handling event: %s", e, exc_info=True)
+            finally:
+                self._active_reviews.pop(review_id, None)
@@ -1,18 +1,30 @@
-import os
+import atexit
+import queue
 import sys
 import logging
+import logging.handlers
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 
 from gerrit.stream import GerritStreamListener
 from gerrit.client import GerritRestClient
 from analyzer.analyzer import LiteLLMAnalyzer
+from bot.config import load_config
 from bot.handler import ReviewHandler
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(filename)s:%(lineno)d - %(levelname)s - %(message)s'
-)
+# Configure logging. Records are handed to a queue and formatted/written by a background
+# listener thread, so logging from the stream reader or review loop never blocks on stderr.
+_log_handler = logging.StreamHandler()
+_log_handler.setFormatter(logging.Formatter('%(asctime)s - %(filename)s:%(lineno)d - %(levelname)s - %(message)s'))
+_log_queue = queue.SimpleQueue()
+_queue_handler = logging.handlers.QueueHandler(_log_queue)
+# Only merge the message args on the calling thread; the full format is applied by the listener
+_queue_handler.setFormatter(logging.Formatter('%(message)s'))
+_log_listener = logging.handlers.QueueListener(_log_queue, _log_handler)
+logging.basicConfig(level=logging.INFO, handlers=[_queue_handler])
+_log_listener.start()
+# Flush whatever is still queued on exit, including sys.exit() paths
+atexit.register(_log_listener.stop)
 logging.getLogger("httpx").setLevel(logging.WARNING)
 logging.getLogger("httpcore").setLevel(logging.WARNING)
 logging.getLogger("openai").setLevel(logging.WARNING)
@@ -23,89 +35,65 @@ logger = logging.getLogger(__name__)
 def main():
     load_dotenv()
 
-    # Gerrit connection settings
-    gerrit_ssh_host = os.getenv("GERRIT_SSH_HOST", "localhost")
-    try:
-        gerrit_ssh_port = int(os.getenv("GERRIT_SSH_PORT", "29418"))
-    except ValueError:
-        logger.warning("Invalid GERRIT_SSH_PORT provided. Defaulting to 29418.")
-        gerrit_ssh_port = 29418
-    gerrit_rest_url = os.getenv("GERRIT_REST_URL", "http://localhost:8080")
-    gerrit_username = os.getenv("GERRIT_USERNAME")
-    gerrit_ssh_key_path = os.getenv("GERRIT_SSH_KEY_PATH")
-    gerrit_ssh_host_key = os.getenv("GERRIT_SSH_HOST_KEY")
-    gerrit_http_password = os.getenv("GERRIT_HTTP_PASSWORD")
-    
-    # LiteLLM settings
-    # For litellm proxy, we just need the api_base. The model name dictates the provider.
-    litellm_proxy_url = os.getenv("LITELLM_PROXY_URL")
-    # The default model string to pass to litigation proxy (e.g. gpt-4, claude-3-opus, gemini-pro)
-    llm_model = os.getenv("LLM_MODEL")
-    litellm_api_key = os.getenv("LITELLM_MASTER_KEY")
-    
-    try:
-        llm_temperature = float(os.getenv("LLM_TEMPERATURE", "0.2"))
-    except ValueError:
-        logger.warning("Invalid LLM_TEMPERATURE provided. Defaulting to 0.2.")
-        llm_temperature = 0.2
-        
-    try:
-        max_workers = int(os.getenv("MAX_WORKERS", "5"))
-    except ValueError:
-        logger.warning("Invalid MAX_WORKERS provided. Defaulting to 5.")
-        max_workers = 5
-    
-    if not all([gerrit_ssh_host, gerrit_ssh_port]):
+    cfg = load_config()
+
+    if not all([cfg.gerrit_ssh_host, cfg.gerrit_ssh_port]):
         logger.error("Missing required environment variables: GERRIT_SSH_HOST or GERRIT_SSH_PORT")
         sys.exit(1)
 
-    if not all([gerrit_username, gerrit_ssh_key_path, gerrit_http_password]):
+    if not all([cfg.gerrit_username, cfg.gerrit_ssh_key_path, cfg.gerrit_http_password]):
         logger.error("Missing required environment variables: GERRIT_USERNAME, GERRIT_SSH_KEY_PATH, or GERRIT_HTTP_PASSWORD")
         sys.exit(1)
 
-    if not all([litellm_proxy_url, llm_model]):
+    if not all([cfg.litellm_proxy_url, cfg.llm_model]):
         logger.error("Missing required environment variables: LITELLM_PROXY_URL or LLM_MODEL")
         sys.exit(1)
 
-    logger.info(f"Starting Gerrit Review Bot '{gerrit_username}'")
-    logger.info(f"Connecting to Gerrit SSH at {gerrit_ssh_host}:{gerrit_ssh_port}")
-    logger.info(f"Connecting to Gerrit REST API at {gerrit_rest_url}")
-    logger.info(f"Using LiteLLM Proxy at {litellm_proxy_url} with model {llm_model}")
-
-    # Initialize components
-    rest_client = GerritRestClient(
-        base_url=gerrit_rest_url,
-        username=gerrit_username,
-        password=gerrit_http_password,
-        max_workers=max_workers,
-    )
-
-    analyzer = LiteLLMAnalyzer(
-        api_base=litellm_proxy_url,
-        model=llm_model,
-        api_key=litellm_api_key,
-        temperature=llm_temperature
-    )
+    logger.info(f"Starting Gerrit Review Bot '{cfg.gerrit_username}'")
+    logger.info(f"Connecting to Gerrit SSH at {cfg.gerrit_ssh_host}:{cfg.gerrit_ssh_port}")
+    logger.info(f"Connecting to Gerrit REST API at {cfg.gerrit_rest_url}")
+    logger.info(f"Using LiteLLM Proxy at {cfg.litellm_proxy_url} with model {cfg.llm_model}")
 
-    remove_bot_reviewer = os.getenv("REMOVE_BOT_REVIEWER", "False").lower() in ("true", "1", "yes")
-    verify_ssh_host = os.getenv("VERIFY_SSH_HOST", "True").lower() in ("true", "1", "yes")
+    # Initialize components. The REST client and analyzer are independent and each builds
+    # an HTTP client (SSL context, CA bundle), so construct them side by side.
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        rest_client_future = executor.submit(
+            GerritRestClient,
+            base_url=cfg.gerrit_rest_url,
+            username=cfg.gerrit_username,
+            password=cfg.gerrit_http_password,
+        )
+        analyzer_future = executor.submit(
+            LiteLLMAnalyzer,
+            api_base=cfg.litellm_proxy_url,
+            model=cfg.llm_model,
+            api_key=cfg.litellm_api_key,
+            temperature=cfg.llm_temperature,
+            max_workers=cfg.max_workers,
+            max_tokens=cfg.llm_max_tokens,
+            stream=cfg.llm_stream,
+            cache_system_prompt=cfg.llm_cache_system_prompt
+        )
+        rest_client = rest_client_future.result()
+        analyzer = analyzer_future.result()
 
     handler = ReviewHandler(
-        bot_username=gerrit_username,
+        bot_username=cfg.gerrit_username,
         rest_client=rest_client,
         analyzer=analyzer,
-        remove_after_review=remove_bot_reviewer
+        remove_after_review=cfg.remove_bot_reviewer,
+        debounce_delay=cfg.review_debounce_seconds
     )
 
     stream_listener = GerritStreamListener(
-        host=gerrit_ssh_host,
-        port=gerrit_ssh_port,
-        username=gerrit_username,
-        key_filename=gerrit_ssh_key_path,
-        host_key=gerrit_ssh_host_key,
+        host=cfg.gerrit_ssh_host,
+        port=cfg.gerrit_ssh_port,
+        username=cfg.gerrit_username,
+        key_filename=cfg.gerrit_ssh_key_path,
+        host_key=cfg.gerrit_ssh_host_key,
         event_handler=handler.handle_event,
-        verify_host_key=verify_ssh_host,
-        max_workers=max_workers
+        verify_host_key=cfg.verify_ssh_host,
+        max_workers=cfg.max_workers
     )
 
     try:
@@ -0,0 +1,72 @@
+from analyzer.analyzer import LiteLLMAnalyzer
+
+
+def make_analyzer():
+    return LiteLLMAnalyzer(api_base="http://litellm:4000", model="test-model")
+
+
+def test_merge_results_takes_lowest_vote_and_merges_comments():
+    """Per-file results are reduced into a single review."""
+    analyzer = make_analyzer()
+    usage = {"model": "m", "prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15, "cost": 0.5}
+    results = [
+        ("Looks fine.", {"a.py": [{"line": 1, "message": "nit"}]}, 1, usage),
+        ("Bug found.", {"b.py": [{"line": 2, "message": "bug"}]}, -1, usage),
+        RuntimeError("boom"),
+    ]
+
+    message, comments, vote = analyzer._merge_results(["a.py", "b.py", "c.py"], results)
+
+    assert vote == -1
+    assert set(comments) == {"a.py", "b.py"}
+    assert "**a.py:** Looks fine." in message
+    assert "**c.py:** An error occurred" in message
+    assert "* Total Tokens: 30" in message
+
+
+def test_prepare_diffs_skips_whitespace_only_and_truncates_large_diffs():
+    """Whitespace-only diffs are dropped and oversized diffs keep only their head and tail."""
+    analyzer = LiteLLMAnalyzer(api_base="http://litellm:4000", model="test-model", max_diff_chars=200)
+    whitespace_only = "@@ -1,1 +1,1 @@\n      | -    x  =   1  \n    1 | +    x = 1"
+    large = "\n".join(f" {n:4d} | +line {n}" for n in range(1, 100))
+
+    diffs, notes = analyzer._prepare_diffs({"ws.py": whitespace_only, "large.py": large})
+
+    assert list(diffs) == ["large.py"]
+    assert "... [diff truncated 88 lines] ..." in diffs["large.py"]
+    assert len(notes) == 2
+
+
+def test_whitespace_check_keeps_indentation_order_and_token_changes():
+    """Changes that only look like whitespace edits can still change behaviour and must be reviewed."""
+    analyzer = make_analyzer()
+    dedent = (
+        "      | -    if user.is_admin:\n      | -        delete_all()\n"
+        "    1 | +    if user.is_admin:\n    2 | +    delete_all()"
+    )
+    swap = "      | -close(f)\n      | -write(f, data)\n    1 | +write(f, data)\n    2 | +close(f)"
+    joined = "      | -return x\n    1 | +returnx"
+    moved_across_hunks = (
+        "@@ -1,1 +1,0 @@\n      | -    check_auth()\n... skipped 47 lines ...\n"
+        "@@ -49,1 +48,2 @@\n   48 |      run()\n   49 | +    check_auth()"
+    )
+    moved_within_hunk = "      | -    return x\n   10 |      cleanup()\n   11 | +    return x"
+    string_literal = '      | -SEP = "  "\n    1 | +SEP = " "'
+
+    assert not analyzer._is_whitespace_only(dedent)
+    assert not analyzer._is_whitespace_only(swap)
+    assert not analyzer._is_whitespace_only(joined)
+    assert not analyzer._is_whitespace_only(moved_across_hunks)
+    assert not analyzer._is_whitespace_only(moved_within_hunk)
+    assert not analyzer._is_whitespace_only(string_literal)
+
+
+def test_prepare_diffs_notes_header_only_diffs_as_no_content_changes():
+    """A rename without line changes is not reported as a whitespace-only change."""
+    analyzer = make_analyzer()
+    rename = "diff --git a/old.py b/new.py\nsimilarity index 100%\nrename from old.py\nrename to new.py"
+
+    diffs, notes = analyzer._prepare_diffs({"new.py": rename})
+
+    assert diffs == {}
+    assert notes == ["* Skipped `new.py`: no content changes (rename or mode change only)."]
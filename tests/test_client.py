@@ -0,0 +1,98 @@
+from gerrit.client import GerritRestClient
+
+
+def make_client():
+    return GerritRestClient(base_url="http://gerrit:8080", username="bot", password="secret")
+
+
+def test_format_diff_numbers_new_side_lines():
+    """Common and added lines carry their new-side line number; removed lines carry none."""
+    diff_data = {
+        "diff_header": ["diff --git a/a.py b/a.py"],
+        "content": [
+            {"ab": ["x", "y"]},
+            {"a": ["old"], "b": ["new", "new2"]},
+            {"skip": 5},
+            {"ab": ["z"]},
+        ],
+    }
+
+    formatted, valid_lines = make_client()._format_diff(diff_data)
+
+    assert formatted.split("\n") == [
+        "diff --git a/a.py b/a.py",
+        "@@ -1,2 +1,2 @@",
+        "    1 |  x",
+        "    2 |  y",
+        "@@ -3,1 +3,2 @@",
+        "      | -old",
+        "    3 | +new",
+        "    4 | +new2",
+        "... skipped 5 lines ...",
+        "@@ -9,1 +10,1 @@",
+        "   10 |  z",
+    ]
+    assert valid_lines == {1, 2, 3, 4, 10}
+
+
+def test_parse_patch_splits_files_in_format_diff_layout():
+    """A revision patch is split per file, numbered like _format_diff, skipping binaries."""
+    patch = "\n".join([
+        "From 1234 Mon Sep 17 00:00:00 2001",
+        "Subject: [PATCH] Change",
+        "",
+        "---",
+        "diff --git a/a.py b/a.py",
+        "--- a/a.py",
+        "+++ b/a.py",
+        "@@ -1,2 +1,2 @@",
+        " x",
+        "-old",
+        "+new",
+        "@@ -9,1 +9,2 @@",
+        " z",
+        "+-- not a signature",
+        "diff --git a/img.bin b/img.bin",
+        "Binary files a/img.bin and b/img.bin differ",
+        "diff --git a/gone.py b/gone.py",
+        "--- a/gone.py",
+        "+++ /dev/null",
+        "@@ -1 +0,0 @@",
+        "-bye",
+        "-- ",
+        "2.39.0",
+    ])
+
+    files = make_client()._parse_patch(patch)
+
+    assert set(files) == {"a.py", "gone.py"}
+    formatted, valid_lines = files["a.py"]
+    assert formatted.split("\n")[3:] == [
+        "@@ -1,2 +1,2 @@",
+        "    1 |  x",
+        "      | -old",
+        "    2 | +new",
+        "... skipped 6 lines ...",
+        "@@ -9,1 +9,2 @@",
+        "    9 |  z",
+        "   10 | +-- not a signature",
+    ]
+    assert valid_lines == {1, 2, 9, 10}
+    assert files["gone.py"][1] == set()
+
+
+def test_parse_patch_unquotes_escaped_paths():
+    """Quoted non-ASCII paths are keyed by the real file name, as Gerrit expects in review comments."""
+    patch = "\n".join([
+        'diff --git "a/d\\303\\251j\\303\\240.py" "b/d\\303\\251j\\303\\240.py"',
+        '--- "a/d\\303\\251j\\303\\240.py"',
+        '+++ "b/d\\303\\251j\\303\\240.py"',
+        "@@ -1 +1 @@",
+        "-old",
+        "+new",
+    ])
+
+    files = make_client()._parse_patch(patch)
+
+    assert set(files) == {"déjà.py"}
+    assert files["déjà.py"][1] == {1}
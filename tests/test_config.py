@@ -0,0 +1,21 @@
+from bot.config import load_config
+
+
+def test_load_config_coerces_values_and_falls_back_on_invalid(monkeypatch):
+    """Env vars are coerced once, with defaults for values that don't parse."""
+    monkeypatch.setenv("GERRIT_SSH_PORT", "2222")
+    monkeypatch.setenv("LLM_TEMPERATURE", "not-a-float")
+    monkeypatch.setenv("LLM_STREAM", "Yes")
+    monkeypatch.delenv("VERIFY_SSH_HOST", raising=False)
+    load_config.cache_clear()
+
+    try:
+        cfg = load_config()
+
+        assert cfg.gerrit_ssh_port == 2222
+        assert cfg.llm_temperature == 0.2
+        assert cfg.llm_stream is True
+        assert cfg.verify_ssh_host is True
+        assert load_config() is cfg
+    finally:
+        load_config.cache_clear()
@@ -0,0 +1,83 @@
+import asyncio
+
+from bot.handler import ReviewHandler
+
+
+class StubRestClient:
+    def __init__(self):
+        self.posted = []
+
+    async def get_diffs(self, project, change_id, revision_id):
+        return {"a.py": f"diff of {revision_id}"}, {"a.py": {1}}
+
+    async def is_latest_patchset(self, change_id, revision_id):
+        return True
+
+    async def post_review(self, project, change_id, revision_id, message, comments=None, code_review_vote=0):
+        self.posted.append((revision_id, message))
+        return True
+
+    async def remove_reviewer(self, project, change_id, account_id):
+        return True
+
+
+class StubAnalyzer:
+    def __init__(self):
+        self.analyzed = []
+
+    async def analyze(self, diffs, valid_lines=None):
+        self.analyzed.append(diffs)
+        return "Looks good.", {}, 1
+
+
+def make_event(patchset_num, revision_id):
+    return {
+        "type": "reviewer-added",
+        "reviewer": {"username": "bot"},
+        "change": {"project": "proj", "number": 42},
+        "patchSet": {"number": patchset_num, "revision": revision_id},
+    }
+
+
+def test_newer_event_supersedes_pending_review_of_same_change():
+    """An event arriving within the debounce window cancels the earlier review of the same change."""
+    rest_client = StubRestClient()
+    analyzer = StubAnalyzer()
+    handler = ReviewHandler("bot", rest_client, analyzer, debounce_delay=0.05)
+
+    async def run():
+        first = asyncio.create_task(handler.handle_event(make_event(1, "rev1")))
+        await asyncio.sleep(0.01)
+        await asyncio.gather(first, handler.handle_event(make_event(2, "rev2")))
+
+    asyncio.run(run())
+
+    assert analyzer.analyzed == [{"a.py": "diff of rev2"}]
+    assert {revision for revision, _ in rest_client.posted} == {"rev2"}
+    assert ("rev2", "Looks good.") in rest_client.posted
+    assert handler._pending == {}
+
+
+def test_cancelling_the_caller_cancels_the_pending_review():
+    """Cancelling handle_event (e.g. listener shutdown) propagates and cancels the debounced review."""
+    rest_client = StubRestClient()
+    analyzer = StubAnalyzer()
+    handler = ReviewHandler("bot", rest_client, analyzer, debounce_delay=0.05)
+
+    async def run():
+        caller = asyncio.create_task(handler.handle_event(make_event(1, "rev1")))
+        await asyncio.sleep(0.01)
+        caller.cancel()
+        try:
+            await caller
+        except asyncio.CancelledError:
+            pass
+        else:
+            raise AssertionError("CancelledError was swallowed")
+        await asyncio.sleep(0.1)
+
+    asyncio.run(run())
+
+    assert analyzer.analyzed == []
+    assert rest_client.posted == []
+    assert handler._pending == {}
@@ -0,0 +1,46 @@
+import orjson
+
+from gerrit.stream import GerritStreamListener
+
+
+async def noop_handler(event):
+    pass
+
+
+def test_event_split_across_reads_is_parsed_once():
+    """A line split over two recv chunks is carried over and processed once, when it completes."""
+    listener = GerritStreamListener("gerrit", 29418, "bot", "key", noop_handler)
+    processed = []
+    listener._process_event = lambda event, now: processed.append(event)
+    event = {"type": "reviewer-added", "change": {"number": 1}, "patchSet": {"number": 2}}
+    line = orjson.dumps(event) + b"\n"
+    other = b'{"type":"comment-added"}\n'
+
+    try:
+        pending = listener._handle_data(b"", other + line[:20], now=0)
+        assert processed == []
+        assert pending == line[:20]
+
+        pending = listener._handle_data(pending, line[20:], now=0)
+        assert processed == [event]
+        assert pending == b""
+    finally:
+        listener.stop()
+
+
+def test_stale_replay_is_summarized_once_the_next_read_has_none(caplog):
+    """A run of stale events is reported when a later chunk brings no stale events, not per event."""
+    listener = GerritStreamListener("gerrit", 29418, "bot", "key", noop_handler)
+    stale = b'{"type":"reviewer-added","change":{"number":1},"patchSet":{"number":1},"eventCreatedOn":1}\n'
+
+    try:
+        with caplog.at_level("INFO", logger="gerrit.stream"):
+            listener._handle_data(b"", stale * 3, now=1000)
+            assert "stale events" not in caplog.text
+
+            listener._handle_data(b"", b'{"type":"comment-added"}\n', now=1001)
+
+        assert caplog.text.count("Discarded 3 stale events") == 1
+        assert listener._active_reviews == {}
+    finally:
+        listener.stop()